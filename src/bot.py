@@ -3,6 +3,7 @@ import discord
 from discord.ext.commands import Bot
 import logging
 import redis
+import tempfile
 
 from buffs import (
     handle_buff_message,
@@ -10,21 +11,59 @@ from buffs import (
 )
 from commands.help import HelpCommandCog
 from commands.configuration import FeatureConfigurationCog
+from commands.diagnostics import DiagnosticsCog
+from commands.profiling import ProfilingCog
 from gear_check import ( 
     handle_gear_check_message,
     is_gear_check_message,
 )
+from profiler import (
+    BotProfiler,
+    install_profile_signal_handler,
+)
+from settings import (
+    create_http_cache,
+    create_wcl_client,
+    create_wcl_quota,
+    get_flag_setting,
+    get_setting,
+)
 
 BOT_AUTHOR_ID = 822262145412628521
 COMMAND_PREFIX = 'tog.'
+# how long to profile for when the bot receives SIGUSR1
+SIGNAL_PROFILE_SECONDS = 30
 redis_server = redis.Redis()
+profiler = BotProfiler()
+
+class TOGHelperBot(Bot):
+    async def close(self):
+        # the warcraft logs client keeps an http session open until it is closed
+        if wcl_client is not None:
+            await wcl_client.close()
+        await super().close()
 
-bot = Bot(command_prefix=COMMAND_PREFIX)
+
+bot = TOGHelperBot(command_prefix=COMMAND_PREFIX)
 bot.add_cog(HelpCommandCog(bot))
 bot.add_cog(FeatureConfigurationCog(bot, redis_server))
+install_profile_signal_handler(bot.loop, profiler, SIGNAL_PROFILE_SECONDS, tempfile.gettempdir())
+
+AUTH_TOKEN = get_setting(redis_server, 'TOG_BOT_AUTH_TOKEN')
+WCL_TOKEN = get_setting(redis_server, 'WCL_TOKEN')
+
+http_cache = create_http_cache(redis_server)
+wcl_quota = create_wcl_quota(redis_server)
+wcl_client = create_wcl_client(redis_server, wcl_quota)
+bot.add_cog(ProfilingCog(bot, profiler))
+bot.add_cog(DiagnosticsCog(bot, http_cache, wcl_quota))
 
-AUTH_TOKEN = str(redis_server.get('TOG_BOT_AUTH_TOKEN').decode('utf-8'))
-WCL_TOKEN = str(redis_server.get('WCL_TOKEN').decode('utf-8'))
+# In progressive mode gear checks are forwarded as soon as they are classified,
+# and the forwarded message is edited once their raid logs have been looked up.
+GEAR_CHECK_PROGRESSIVE = get_flag_setting(redis_server, 'GEAR_CHECK_PROGRESSIVE')
+# With the job queue enabled, gear checks are finished by worker processes
+# (see worker.py) rather than by the bot.
+GEAR_CHECK_QUEUE = get_flag_setting(redis_server, 'GEAR_CHECK_QUEUE')
 
 @bot.event 
 async def on_ready():
@@ -43,7 +82,11 @@ async def on_message(message):
         if message.author.id == BOT_AUTHOR_ID:
             return
         elif is_gear_check_message(message):
-            return await handle_gear_check_message(message, bot, WCL_TOKEN, redis_server)
+            return await handle_gear_check_message(
+                message, bot, WCL_TOKEN, redis_server,
+                wcl_client=wcl_client, progressive=GEAR_CHECK_PROGRESSIVE,
+                http_cache=http_cache, queue_jobs=GEAR_CHECK_QUEUE, wcl_quota=wcl_quota
+            )
         elif is_buff_message(message, bot, redis_server):
             return await handle_buff_message(message, bot, redis_server)
     except Exception as e:
@@ -8,10 +8,27 @@ from utils import (
     convert_to_json_str,    
 )
 from models import (
+    DEFAULT_REGION,
     get_or_create_guild_config,
     MENTION_ALL_ROLES_ID,
+    RealmInfo,
+    REGION_ALIASES,
+    SUPPORTED_REGIONS,
 )
 
+def parse_realm_info(realm_name: str):
+    """
+    Parses a realm given like 'Faerlina' or 'Zandalar Tribe:EU' into a RealmInfo.
+
+    Returns None if the region isn't one that warcraft logs has servers in.
+    """
+    realm, _, region = realm_name.partition(':')
+    region = region.strip().upper() or DEFAULT_REGION
+    region = REGION_ALIASES.get(region, region)
+    if region not in SUPPORTED_REGIONS:
+        return None
+    return RealmInfo(realm.strip(), region)
+
 class FeatureConfigurationCog(commands.Cog):
     """ A custom cog containing commands for configuring features """
     def __init__(self, bot, redis_server):
@@ -19,27 +36,39 @@ class FeatureConfigurationCog(commands.Cog):
         self.redis_server = redis_server
 
     @commands.command()
-    async def setup_gear_check(self, ctx, source_guild_id: int, realm: str):
+    async def setup_gear_check(self, ctx, source_guild_id: int, *realm_names: str):
         """
         Configures the bot to send gear check information to the channel in which this
         command was sent.
         
-        Two arguments should be given:
+        Two or more arguments should be given:
         - The first is the ID of the server that has gear check 
           messages sent to it, via channels like (bwl-gear-check, mc-gear-check) etc.
-        - The second is the name of the realm that you are playing on
+        - The rest are the names of the realms that your applicants may be playing on,
+          most likely first. A realm outside of the US region can be given as Realm:REGION,
+          where REGION is one of US, EU, KR, TW or CN, and realm names with spaces
+          should be put in quotes.
 
         Example usage is:
-        tog.setup_gear_check 806389180162506802 Faerlina
+        tog.setup_gear_check 806389180162506802 Faerlina Benediction "Zandalar Tribe:EU"
         """        
         if not ctx.guild:
             return await ctx.send('This command can only be used in the channel of a discord server!')
 
+        if len(realm_names) == 0:
+            return await ctx.send('Please give the name of at least one realm.')
+        realms = [parse_realm_info(realm_name) for realm_name in realm_names]
+        if None in realms:
+            return await ctx.send(
+                f'Realm regions must be one of {", ".join(SUPPORTED_REGIONS)}, ' + \
+                'for example "Zandalar Tribe:EU".'
+            )
+
         dest_guild_config = get_or_create_guild_config(self.redis_server, ctx.guild.id)
         add_success = dest_guild_config.destination_config.add_gear_check_source(
             source_guild_id,
             ctx.channel.id,
-            realm
+            realms
         )
         if not add_success:
             return await ctx.send(
@@ -58,7 +87,7 @@ class FeatureConfigurationCog(commands.Cog):
         source_guild_config.source_config.add_gear_check_destination(
             ctx.guild.id,
             ctx.channel.id,
-            realm
+            realms
         )
 
         self.redis_server.set(ctx.guild.id, convert_to_json_str(dest_guild_config))
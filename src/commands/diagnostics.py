@@ -0,0 +1,39 @@
+"""Commands for checking on the bot's caches and upstream budgets"""
+from discord.ext import commands
+
+class DiagnosticsCog(commands.Cog):
+    """ A custom cog containing commands for reporting the state of the bot's caches and budgets """
+    def __init__(self, bot, http_cache, wcl_quota):
+        self.bot = bot
+        self.http_cache = http_cache
+        self.wcl_quota = wcl_quota
+
+    @commands.command()
+    @commands.is_owner()
+    async def cache_stats(self, ctx):
+        """
+        Shows how often gear pages and warcraft logs responses were found in the
+        on-disk cache, and how many of those were revalidated rather than downloaded.
+        These include the gear check workers sharing this cache directory.
+        """
+        stats = self.http_cache.get_stats()
+        await ctx.send(
+            f'Hits: {stats["hits"]}, revalidated: {stats["revalidations"]}, ' + \
+            f'downloaded: {stats["misses"]}, ' + \
+            f'evictions: {stats["evictions"]}.\n' + \
+            f'{stats["entries"]} entries using {stats["bytes"] / (1024 * 1024):.1f} MB.'
+        )
+
+    @commands.command()
+    @commands.is_owner()
+    async def wcl_budget(self, ctx):
+        """
+        Shows how many warcraft logs requests can be made right now, and how many
+        of this process's lookups are waiting for budget.
+        """
+        remaining_budget = await self.wcl_quota.get_remaining_budget()
+        await ctx.send(
+            f'{remaining_budget:.0f} of {self.wcl_quota.burst} warcraft logs requests available ' + \
+            f'(refilling at {self.wcl_quota.requests_per_hour} per hour), ' + \
+            f'{self.wcl_quota.queue_depth} lookups waiting.'
+        )
@@ -0,0 +1,40 @@
+"""Commands for profiling the bot while it is running"""
+import discord
+import io
+
+from discord.ext import commands
+
+from profiler import ProfileAlreadyRunningError
+
+MAX_PROFILE_SECONDS = 300
+
+class ProfilingCog(commands.Cog):
+    """ A custom cog containing commands for diagnosing the bot's performance """
+    def __init__(self, bot, profiler):
+        self.bot = bot
+        self.profiler = profiler
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: int = 30):
+        """
+        Profiles the bot for the given number of seconds, then sends back the
+        functions it spent the most time in and the sites that allocated the most memory.
+
+        The bot keeps handling messages while it is being profiled.
+
+        Example usage is:
+        tog.profile 60
+        """
+        if seconds <= 0 or seconds > MAX_PROFILE_SECONDS:
+            return await ctx.send(f'Please profile for between 1 and {MAX_PROFILE_SECONDS} seconds.')
+
+        await ctx.send(f'Profiling for {seconds} seconds...')
+        try:
+            report = await self.profiler.profile(seconds)
+        except ProfileAlreadyRunningError:
+            return await ctx.send('A profile is already running, please wait for it to finish.')
+        await ctx.send(
+            'Profiling finished.',
+            file=discord.File(io.BytesIO(report.encode('utf-8')), filename='profile.txt')
+        )
@@ -1,13 +1,40 @@
 """Module for bot functionality related to gear checking"""
 
+import asyncio
 import discord
+import functools
+import json
 import logging
 import re
 
 from requests_html import AsyncHTMLSession
-from urllib import request
+from urllib import (
+    error,
+    request,
+)
+from urllib.parse import quote
 
-from models import get_or_create_guild_config
+from job_queue import enqueue_gear_check_job
+from models import (
+    DEFAULT_REGION,
+    get_or_create_guild_config,
+    GearCheckJob,
+    RealmInfo,
+)
+from utils import (
+    convert_json_to_object,
+    convert_to_json_str,
+)
+from wcl_quota import (
+    PRIORITY_INTERACTIVE,
+    QuotaExhaustedError,
+)
+from warcraft_logs import (
+    build_warcraft_logs_url,
+    format_parse_summary,
+    get_server_slug,
+    summarize_zone_rankings,
+)
 
 GEAR_CHECK_CHANNEL_SUFFIX = '-gear-check'
 
@@ -26,6 +53,17 @@ SUPPORTED_GEAR_URL_REGEXES = [
 # Subsequent tries seem to work, though, so we will retry up to this many times. 
 MAX_FETCH_CHARACTER_NAME_RETRIES = 5
 
+# the realm each character was last found on for a gear check configuration is kept
+# in redis under this prefix, for long enough to cover a raid tier but not forever,
+# in case they transfer again
+CHARACTER_REALM_KEY_PREFIX = 'wcl_character_realm:'
+CHARACTER_REALM_CACHE_SECONDS = 30 * 24 * 60 * 60
+
+# the messages each gear check has sent are kept in redis under this prefix, so a
+# gear check that is retried doesn't send them again. Retries happen well within a day.
+GEAR_CHECK_PROGRESS_KEY_PREFIX = 'gear_check_progress:'
+GEAR_CHECK_PROGRESS_SECONDS = 24 * 60 * 60
+
 
 # maps a channel prefix like 'mc' to the corresponding zone id in warcraft logs
 channel_prefix_to_zone_id_map = {
@@ -35,6 +73,10 @@ channel_prefix_to_zone_id_map = {
     'naxx': 1006
 }
 
+# holds a reference to gear checks that are being finished in the background,
+# so they aren't garbage collected before they finish
+background_tasks = set()
+
 def is_gear_check_message(message):
     """Returns whether the given message was sent in a gear check channel"""
     try: 
@@ -45,12 +87,35 @@ def is_gear_check_message(message):
         logging.error(e)
         return False
 
-async def handle_gear_check_message(message, bot, wcl_token, redis_server):
+async def handle_gear_check_message(message,
+                                    bot,
+                                    wcl_token,
+                                    redis_server,
+                                    wcl_client=None,
+                                    progressive=False,
+                                    http_cache=None,
+                                    queue_jobs=False,
+                                    wcl_quota=None):
     """
     Handler for incoming gear check messages.
 
     Parses the message and sends a message with a link to the original 
     as well as a link to the player's warcraft logs for the relevant raid.
+
+    If a WarcraftLogsGraphQLClient is given, logs are looked up through the
+    warcraft logs v2 api, otherwise through the v1 api with the given wcl_token.
+
+    In progressive mode, the message is forwarded as soon as it is classified
+    and edited once the character name and logs have been looked up.
+
+    If an HTTPCache is given, gear pages and v1 api responses are revalidated
+    against it rather than downloaded again.
+
+    If queue_jobs is set, the rest of the gear check is left to a worker
+    process (see worker.py) by adding a job to the gear check redis stream.
+
+    If a WarcraftLogsQuota is given, warcraft logs are only looked up while
+    there is budget for them.
     """
     destination_infos = get_destination_infos(message, bot, redis_server)
     if len(destination_infos) == 0:
@@ -72,38 +137,364 @@ async def handle_gear_check_message(message, bot, wcl_token, redis_server):
         # a message was sent to the channel that wasn't for a gear check
         return
 
-    character_name = await get_character_name(gear_url, message)
+    job = build_gear_check_job(message, zone_id, gear_url, destination_infos)
 
-    if not character_name and re.match(PRIVATE_SIXTY_UPGRADES_REGEX, gear_url):
-        await message.reply(
-            f'{message.author.mention} your link was private. Please post the ' + \
-            'public link to your gear set.'
+    if progressive:
+        # let officers see the applicant right away, and fill in the rest once
+        # the gear page has rendered and warcraft logs have been looked up
+        pending_embed = build_gear_check_embed(job, 'Looking up their raid logs...')
+        sent_messages = await asyncio.gather(*[
+            bot.http.send_message(
+                destination_info.destination_channel_id, None, embed=pending_embed.to_dict()
+            )
+            for destination_info in destination_infos
+        ])
+        job.sent_message_ids = [int(sent['id']) for sent in sent_messages]
+
+    if queue_jobs:
+        return enqueue_gear_check_job(redis_server, job)
+
+    if progressive:
+        task = asyncio.ensure_future(
+            process_gear_check_job(
+                job, bot.http, wcl_token, wcl_client, http_cache, wcl_quota, redis_server
+            )
         )
+        background_tasks.add(task)
+        task.add_done_callback(functools.partial(on_background_task_done, job, bot.http, redis_server))
         return
 
-    if not re.match(SIXTY_UPGRADES_REGEX, gear_url):
-        await message.reply(
-            f'{message.author.mention} Please use https://sixtyupgrades.com/ to post your gear. ' + \
+    await process_gear_check_job(
+        job, bot.http, wcl_token, wcl_client, http_cache, wcl_quota, redis_server
+    )
+
+
+def build_gear_check_job(message, zone_id, gear_url, destination_infos):
+    """Returns a GearCheckJob with everything needed to finish the gear check for the message"""
+    return GearCheckJob(
+        message_id=message.id,
+        channel_id=message.channel.id,
+        guild_id=message.guild.id,
+        channel_name=message.channel.name,
+        author_display_name=message.author.display_name,
+        author_mention=message.author.mention,
+        jump_url=message.jump_url,
+        zone_id=zone_id,
+        gear_url=gear_url,
+        destination_infos=destination_infos,
+    )
+
+
+def on_background_task_done(job, http, redis_server, task):
+    """
+    Logs the error of a gear check that failed in the background, and replaces
+    the placeholders it left behind so officers aren't left waiting on them.
+    """
+    background_tasks.discard(task)
+    if task.cancelled() or task.exception() is None:
+        return
+    logging.error(task.exception())
+    fallback_task = asyncio.ensure_future(
+        edit_pending_gear_check_messages(job, http, redis_server, 'Raid logs could not be retrieved.')
+    )
+    background_tasks.add(fallback_task)
+    fallback_task.add_done_callback(on_fallback_task_done)
+
+
+def on_fallback_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(task.exception())
+
+
+async def edit_pending_gear_check_messages(job, http, redis_server, wcl_message):
+    """
+    Edits the messages that were forwarded for the GearCheckJob in progressive mode,
+    and that haven't been filled in yet, to show the given wcl_message.
+    """
+    if not job.sent_message_ids:
+        return
+    progress = get_gear_check_progress(redis_server, job)
+    embed = build_gear_check_embed(job, wcl_message)
+    for destination_info, message_id in zip(job.destination_infos, job.sent_message_ids):
+        channel_id = destination_info.destination_channel_id
+        if f'destination:{channel_id}' not in progress:
+            await http.edit_message(channel_id, message_id, embed=embed.to_dict())
+
+
+async def process_gear_check_job(job,
+                                 http,
+                                 wcl_token,
+                                 wcl_client=None,
+                                 http_cache=None,
+                                 wcl_quota=None,
+                                 redis_server=None):
+    """
+    Resolves the character name and warcraft logs for the given GearCheckJob,
+    and forwards the results to each of its destinations using the given discord
+    HTTPClient.
+
+    If the job was already forwarded (in progressive mode), the forwarded
+    messages are edited in place instead.
+
+    If a redis server is given, the realm each character is found on is
+    remembered, so later gear checks look there first. Each reply and forward
+    is also recorded there, so a job that is run again after failing partway
+    through (see job_queue.py) edits what it already sent rather than sending
+    it twice.
+    """
+    character_name = await resolve_character_name(job, http, http_cache, redis_server)
+    if character_name is None:
+        await edit_pending_gear_check_messages(
+            job, http, redis_server, 'Their gear check link was private.'
+        )
+        return
+
+    lookups = await lookup_warcraft_logs_for_destinations(
+        job.zone_id, character_name, job.destination_infos,
+        wcl_token, wcl_client, http_cache, wcl_quota, redis_server
+    )
+    for i, (destination_info, (wcl_url, parse_summary)) in enumerate(zip(job.destination_infos, lookups)):
+        embed = build_gear_check_embed(job, get_wcl_message(character_name, wcl_url, parse_summary))
+        channel_id = destination_info.destination_channel_id
+        progress_step = f'destination:{channel_id}'
+        sent_message_id = job.sent_message_ids[i] if job.sent_message_ids else \
+            get_gear_check_progress(redis_server, job).get(progress_step)
+        if sent_message_id is not None:
+            await http.edit_message(channel_id, sent_message_id, embed=embed.to_dict())
+        else:
+            sent = await http.send_message(channel_id, None, embed=embed.to_dict())
+            sent_message_id = sent['id']
+        # filled in messages are left alone if the job fails partway through
+        record_gear_check_progress(redis_server, job, progress_step, sent_message_id)
+
+
+async def resolve_character_name(job, http, http_cache=None, redis_server=None):
+    """
+    Returns the character name for the given GearCheckJob, replying to the sender
+    if their link was not what we expected.
+
+    Returns None if the gear check should not be forwarded any further.
+    """
+    character_name = await get_character_name(job.gear_url, job.author_display_name, http_cache)
+
+    if not character_name and re.match(PRIVATE_SIXTY_UPGRADES_REGEX, job.gear_url):
+        await reply_to_gear_check(
+            job, http, redis_server,
+            f'{job.author_mention} your link was private. Please post the ' + \
+            'public link to your gear set.'
+        )
+        return None
+
+    if not re.match(SIXTY_UPGRADES_REGEX, job.gear_url):
+        await reply_to_gear_check(
+            job, http, redis_server,
+            f'{job.author_mention} Please use https://sixtyupgrades.com/ to post your gear. ' + \
             'Doing this lets us know you know how to follow directions and helps us with our decision making. Thanks!'
         )
+    return character_name
+
+
+async def reply_to_gear_check(job, http, redis_server, content):
+    if 'reply' in get_gear_check_progress(redis_server, job):
+        return
+    sent = await http.send_message(
+        job.channel_id,
+        content,
+        message_reference={
+            'message_id': job.message_id,
+            'channel_id': job.channel_id,
+            'guild_id': job.guild_id,
+        }
+    )
+    record_gear_check_progress(redis_server, job, 'reply', sent['id'])
+
+
+def get_gear_check_progress(redis_server, job):
+    """
+    Returns a dict of the steps of the GearCheckJob that already sent a message
+    (eg 'reply' or 'destination:<channel id>') to the id of the message they sent.
+    """
+    if redis_server is None:
+        return {}
+    progress = redis_server.hgetall(GEAR_CHECK_PROGRESS_KEY_PREFIX + str(job.message_id))
+    return {step.decode('utf-8'): int(message_id) for step, message_id in progress.items()}
+
 
-    for destination_info in destination_infos:
-        wcl_url = get_warcraft_logs_url(zone_id, character_name, wcl_token, destination_info.realm)
+def record_gear_check_progress(redis_server, job, step, sent_message_id):
+    if redis_server is None:
+        return
+    key = GEAR_CHECK_PROGRESS_KEY_PREFIX + str(job.message_id)
+    redis_server.hset(key, step, sent_message_id)
+    redis_server.expire(key, GEAR_CHECK_PROGRESS_SECONDS)
+
+
+async def lookup_warcraft_logs_for_destinations(zone_id,
+                                                character_name,
+                                                destination_infos,
+                                                wcl_token,
+                                                wcl_client,
+                                                http_cache=None,
+                                                wcl_quota=None,
+                                                redis_server=None,
+                                                priority=PRIORITY_INTERACTIVE):
+    """
+    Returns a list of (warcraft logs url, parse summary) tuples, one for each
+    of the given destination infos. Both are None if logs could not be found.
+
+    If the WarcraftLogsQuota has no budget left for a lookup, a plain link to
+    the character page is returned without asking warcraft logs whether it exists.
+    Budget is taken per request sent to warcraft logs: one per v1 lookup, and one
+    per v2 batch (taken by the WarcraftLogsGraphQLClient).
+    """
+    unchecked_realms = []
 
-        wcl_message = f'Please also check their [raid logs]({wcl_url}).' if wcl_url is not None \
-                  else f'Raid logs could not be retrieved for character: {character_name}'
-        embed = discord.Embed()
-        embed.add_field(
-            name=f'{message.author.display_name} just submitted a gear check request in ' + \
-                 f'{message.channel.name}:',
-            value=f'You can view it [here]({message.jump_url}). \n {wcl_message}'
+    async def lookup_character(realm_info):
+        """Returns the (url, summary) for the character on the given realm, or None"""
+        if wcl_client is not None:
+            try:
+                zone_rankings = await wcl_client.get_zone_rankings(
+                    zone_id, character_name, realm_info.realm, realm_info.region, priority
+                )
+            except QuotaExhaustedError:
+                unchecked_realms.append(realm_info)
+                return None
+            summary = None if zone_rankings is None else summarize_zone_rankings(zone_rankings)
+            found = zone_rankings is not None
+        else:
+            if wcl_quota is not None and not await wcl_quota.acquire(priority):
+                unchecked_realms.append(realm_info)
+                return None
+            # the v1 api is only reachable with a blocking request, so keep it off the event loop
+            loop = asyncio.get_event_loop()
+            parses = await loop.run_in_executor(
+                None, get_warcraft_logs_parses,
+                zone_id, character_name, wcl_token, realm_info.realm, http_cache, realm_info.region
+            )
+            summary = None if parses is None else summarize_parses(parses)
+            found = parses is not None
+        if not found:
+            return None
+        return (
+            build_warcraft_logs_url(zone_id, character_name, realm_info.realm, realm_info.region),
+            summary
         )
-        guild = discord.utils.get(bot.guilds, id=destination_info.destination_guild_id)
-        channel = discord.utils.get(guild.channels, id=destination_info.destination_channel_id)
-        await channel.send(embed=embed)
 
+    async def lookup_destination(destination_info):
+        candidate_realms = list(destination_info.realms)
+        # a character we found before is most likely still on the same realm,
+        # so try that alone before spending budget on every other candidate
+        cached_realm = None
+        if redis_server is not None:
+            cached_realm = get_cached_character_realm(redis_server, destination_info, character_name)
+        if cached_realm in candidate_realms:
+            result = await lookup_character(cached_realm)
+            if result is not None:
+                return result
+            if cached_realm in unchecked_realms:
+                return get_unchecked_lookup(zone_id, character_name, cached_realm)
+            candidate_realms.remove(cached_realm)
+
+        if len(candidate_realms) == 0:
+            return (None, None)
+
+        realm_info, result = await find_first_result(candidate_realms, lookup_character)
+        if result is None:
+            unchecked_candidates = [realm for realm in candidate_realms if realm in unchecked_realms]
+            if len(unchecked_candidates) > 0:
+                return get_unchecked_lookup(zone_id, character_name, unchecked_candidates[0])
+            return (None, None)
+        if redis_server is not None:
+            cache_character_realm(redis_server, destination_info, character_name, realm_info)
+        return result
+
+    # look up every destination at once so that, with the v2 api,
+    # the lookups for every candidate realm share one batch
+    return await asyncio.gather(*[
+        lookup_destination(destination_info) for destination_info in destination_infos
+    ])
+
+
+async def find_first_result(candidates, lookup):
+    """
+    Runs the given lookup for every candidate at once, returning the first
+    (candidate, result) that found something and cancelling the rest.
 
-async def get_character_name(gear_url, message):
+    Candidates that finish at the same time are preferred in the order given.
+    Returns (None, None) if none of them found anything.
+    """
+    tasks = {asyncio.ensure_future(lookup(candidate)): i for i, candidate in enumerate(candidates)}
+    pending = set(tasks)
+    try:
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: tasks[task]):
+                if task.exception() is not None:
+                    logging.error(task.exception())
+                elif task.result() is not None:
+                    return candidates[tasks[task]], task.result()
+        return None, None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def get_unchecked_lookup(zone_id, character_name, realm_info):
+    """Returns the (url, summary) to use when we have no budget to check a character's logs"""
+    return (
+        build_warcraft_logs_url(zone_id, character_name, realm_info.realm, realm_info.region),
+        'Their logs were not checked because warcraft logs is busy, so this link may not work.'
+    )
+
+
+def get_character_realm_key(destination_info, character_name):
+    """
+    Returns the redis key for the realm a character was found on for the given
+    GearCheckConfigurationInfo. The same name can belong to different characters
+    on other configurations' realms, so each configuration keeps its own.
+    """
+    return f'{CHARACTER_REALM_KEY_PREFIX}{destination_info.source_guild_id}:' + \
+           f'{destination_info.destination_guild_id}:{character_name.lower()}'
+
+
+def get_cached_character_realm(redis_server, destination_info, character_name):
+    """Returns the RealmInfo that the character was last found on, or None"""
+    cached_realm = redis_server.get(get_character_realm_key(destination_info, character_name))
+    if cached_realm is None:
+        return None
+    return convert_json_to_object(cached_realm.decode('utf-8'), RealmInfo)
+
+
+def cache_character_realm(redis_server, destination_info, character_name, realm_info):
+    redis_server.set(
+        get_character_realm_key(destination_info, character_name),
+        convert_to_json_str(realm_info),
+        ex=CHARACTER_REALM_CACHE_SECONDS
+    )
+
+
+def get_wcl_message(character_name, wcl_url, parse_summary):
+    """Returns the line of a gear check embed that describes the character's logs"""
+    if wcl_url is None:
+        return f'Raid logs could not be retrieved for character: {character_name}'
+    wcl_message = f'Please also check their [raid logs]({wcl_url}).'
+    if parse_summary:
+        wcl_message += f' \n {parse_summary}'
+    return wcl_message
+
+
+def build_gear_check_embed(job, wcl_message):
+    """Returns the embed that is forwarded to officers for the given GearCheckJob"""
+    embed = discord.Embed()
+    embed.add_field(
+        name=f'{job.author_display_name} just submitted a gear check request in ' + \
+             f'{job.channel_name}:',
+        value=f'You can view it [here]({job.jump_url}). \n {wcl_message}'
+    )
+    return embed
+
+
+async def get_character_name(gear_url, default_name, http_cache=None):
     """
     It is *sometimes* the case that discord users don't update their username 
     to be their character name (eg for alts).
@@ -114,20 +505,32 @@ async def get_character_name(gear_url, message):
     This assumes a specific format of the page: player names are nested in
     an h3 element with css class named 'class-[player class]'
 
-    Returns the character's name if successful, otherwise returns the message sender's
-    display name in discord.
+    If an HTTPCache is given and the page hasn't changed since we last rendered it,
+    the name found in that render is returned without rendering the page again.
+
+    Returns the character's name if successful, otherwise returns the given default
+    name (the message sender's display name in discord).
     """
-    name = message.author.display_name
+    name = default_name
     if not re.match(SIXTY_UPGRADES_REGEX, gear_url):
         return name
 
+    cache_entry = http_cache.get(gear_url) if http_cache is not None else None
     for i in range(MAX_FETCH_CHARACTER_NAME_RETRIES):
         try:
             asession = AsyncHTMLSession()
-            webpage = await asession.get(gear_url)
+            headers = cache_entry.get_conditional_headers() \
+                if cache_entry is not None and cache_entry.derived else {}
+            webpage = await asession.get(gear_url, headers=headers)
+            if webpage.status_code == 304:
+                http_cache.record_revalidation(gear_url)
+                name = cache_entry.derived
+                break
             await webpage.html.arender()
             query_selector = "h3[class^='class-']"
             name = webpage.html.find(query_selector, first=True).text
+            if http_cache is not None:
+                http_cache.store(gear_url, webpage.content, webpage.headers, derived=name)
             break
         except Exception as e:
             logging.error(e)
@@ -136,25 +539,62 @@ async def get_character_name(gear_url, message):
     return name
 
 
-def get_warcraft_logs_url(zone_id, character_name, wcl_token, realm):
-    """ 
-    Returns the warcraft logs url for the player with the given character name 
+def get_warcraft_logs_parses(zone_id,
+                             character_name,
+                             wcl_token,
+                             realm,
+                             http_cache=None,
+                             region=DEFAULT_REGION):
+    """
+    Returns the v1 api parses for the player with the given character name
     and the given zone id.
 
+    If an HTTPCache is given, a cached response is revalidated rather than
+    downloaded again.
+
     Returns None if warcraft logs could not be found for the given character.
     """
-    parse_url = f'https://classic.warcraftlogs.com:443/v1/parses/character/' + \
-            f'{character_name}/{realm}/US' + \
-            f'?zone={zone_id}&api_key={wcl_token}'
+    # the cache key leaves out the api key so it never ends up on disk
+    cache_key = f'https://classic.warcraftlogs.com:443/v1/parses/character/' + \
+            f'{quote(character_name)}/{quote(get_server_slug(realm))}/{region}' + \
+            f'?zone={zone_id}'
+    parse_url = f'{cache_key}&api_key={wcl_token}'
+    cache_entry = http_cache.get(cache_key) if http_cache is not None else None
+    headers = cache_entry.get_conditional_headers() if cache_entry is not None else {}
     try:
-        res = request.urlopen(parse_url)
+        try:
+            res = request.urlopen(request.Request(parse_url, headers=headers))
+        except error.HTTPError as e:
+            if e.code != 304:
+                raise
+            http_cache.record_revalidation(cache_key)
+            return json.loads(cache_entry.body.decode('utf-8'))
         if res.status != 200:
             return None
+        body = res.read()
+        if http_cache is not None:
+            http_cache.store(cache_key, body, res.headers)
+        return json.loads(body.decode('utf-8'))
     except Exception as e:
-        print(e)
+        logging.error(e)
+        return None
+
+
+def summarize_parses(parses):
+    """Returns a short summary of the character's best v1 api parses for each boss"""
+    best_percentiles = {}
+    for parse in parses:
+        encounter = parse.get('encounterName')
+        percentile = parse.get('percentile')
+        if encounter is None or percentile is None:
+            continue
+        best_percentiles[encounter] = max(percentile, best_percentiles.get(encounter, 0))
+    if len(best_percentiles) == 0:
         return None
-    return f'https://classic.warcraftlogs.com/character/us/{realm}/' + \
-           f'{character_name}?zone={zone_id}'
+    return format_parse_summary(
+        sum(best_percentiles.values()) / len(best_percentiles),
+        len(best_percentiles)
+    )
 
 
 def get_destination_infos(message, bot, redis_server):
@@ -0,0 +1,156 @@
+"""Module for a persistent on-disk cache of http responses"""
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class CacheEntry(object):
+    """A cached response, along with the validators needed to revalidate it"""
+    def __init__(self,
+                 url: str,
+                 body: bytes,
+                 etag: str = None,
+                 last_modified: str = None,
+                 derived: str = None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        # a value computed from the body (eg a character name pulled out of a rendered
+        # page), so a 304 lets us skip that computation as well as the download
+        self.derived = derived
+
+    def get_conditional_headers(self):
+        """Returns the headers that revalidate this entry with the server"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HTTPCache(object):
+    """
+    Stores http response bodies in a sqlite database, keyed by url.
+
+    Only responses with an ETag or Last-Modified header are stored, since those are
+    the ones we can cheaply revalidate. When the database grows past max_bytes,
+    the least recently used entries are evicted.
+
+    The hit, revalidation, miss and eviction counts are kept in the database too,
+    so they survive restarts and include every process (eg the bot and its gear
+    check workers) using the same cache directory.
+
+    This is safe to use from multiple threads.
+    """
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, '
+            'derived TEXT, size INTEGER, last_access REAL)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, count INTEGER)'
+        )
+        self._connection.commit()
+
+    def get(self, url):
+        """
+        Returns the CacheEntry for the given url, or None if it isn't cached.
+
+        Finding an entry counts as a hit, since the caller will revalidate it.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT body, etag, last_modified, derived FROM entries WHERE url = ?', (url,)
+            ).fetchone()
+            if row is not None:
+                self._increment_stat('hits')
+                self._connection.commit()
+        if row is None:
+            return None
+        return CacheEntry(url, *row)
+
+    def record_revalidation(self, url):
+        """Records that the server said our cached entry for the given url is still fresh"""
+        with self._lock:
+            self._increment_stat('revalidations')
+            self._connection.execute(
+                'UPDATE entries SET last_access = ? WHERE url = ?', (time.time(), url)
+            )
+            self._connection.commit()
+
+    def store(self, url, body, headers, derived=None):
+        """
+        Records a full download of the given url, caching it if the response
+        can be revalidated later.
+        """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        with self._lock:
+            self._increment_stat('misses')
+            if not etag and not last_modified:
+                self._connection.commit()
+                return
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, body, etag, last_modified, derived, len(body), time.time())
+            )
+            self._evict()
+            self._connection.commit()
+
+    def get_stats(self):
+        """
+        Returns a dict of the cache's hit, revalidation, miss and eviction counts and its size.
+
+        A hit is a cached entry that we asked the server to revalidate, and a
+        revalidation is one the server said was still fresh.
+        """
+        with self._lock:
+            stats = {'hits': 0, 'revalidations': 0, 'misses': 0, 'evictions': 0}
+            stats.update(self._connection.execute('SELECT name, count FROM stats').fetchall())
+            stats['entries'], stats['bytes'] = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+            return stats
+
+    def _increment_stat(self, name, count=1):
+        self._connection.execute(
+            'INSERT INTO stats VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET count = count + ?',
+            (name, count, count)
+        )
+
+    def _evict(self):
+        (total_bytes,) = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        rows = self._connection.execute(
+            'SELECT url, size FROM entries ORDER BY last_access'
+        ).fetchall()
+        evicted_urls = []
+        for url, size in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            evicted_urls.append((url,))
+            total_bytes -= size
+        self._connection.executemany('DELETE FROM entries WHERE url = ?', evicted_urls)
+        self._increment_stat('evictions', len(evicted_urls))
+
+
+def open_http_cache(cache_dir, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+    """Opens the HTTPCache in the given directory, creating the directory if needed"""
+    os.makedirs(cache_dir, exist_ok=True)
+    return HTTPCache(os.path.join(cache_dir, 'http_cache.sqlite3'), max_bytes)
@@ -0,0 +1,197 @@
+"""Module for handing gear check jobs from the bot to worker processes over a redis stream"""
+import asyncio
+import functools
+import logging
+import uuid
+
+from redis.exceptions import ResponseError
+
+from models import GearCheckJob
+from utils import (
+    convert_json_to_object,
+    convert_to_json_str,
+)
+
+GEAR_CHECK_STREAM = 'gear_check_jobs'
+GEAR_CHECK_CONSUMER_GROUP = 'gear_check_workers'
+# jobs that failed MAX_JOB_DELIVERIES times are moved here for a human to look at
+GEAR_CHECK_DEAD_LETTER_STREAM = 'gear_check_jobs_dead'
+# keeps the stream from growing forever, well past any realistic backlog
+MAX_STREAM_LENGTH = 10000
+
+MAX_JOB_DELIVERIES = 5
+# a job that was delivered this long ago without being acknowledged belongs to a
+# worker that died or failed it, so another worker may claim it. This has to be
+# longer than a gear check takes, including its render retries.
+CLAIM_IDLE_MILLISECONDS = 5 * 60 * 1000
+# how many of the oldest unacknowledged jobs we check for stuck ones at a time
+CLAIM_BATCH_SIZE = 100
+READ_BLOCK_MILLISECONDS = 5000
+DEFAULT_WORKER_CONCURRENCY = 4
+
+# a running worker holds its consumer name under this prefix, so two workers can't
+# share one and run each other's jobs. A worker that dies releases it after
+# CONSUMER_LEASE_SECONDS, so its replacement may have to wait that long to start.
+CONSUMER_LEASE_KEY_PREFIX = 'gear_check_consumer:'
+CONSUMER_LEASE_SECONDS = 30
+
+# only renews the lease if it is still ours, rather than one another worker took
+# after ours expired
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def enqueue_gear_check_job(redis_server, job):
+    """Adds the given GearCheckJob to the gear check stream"""
+    return redis_server.xadd(
+        GEAR_CHECK_STREAM,
+        {'job': convert_to_json_str(job)},
+        maxlen=MAX_STREAM_LENGTH,
+        approximate=True
+    )
+
+
+class ConsumerNameInUseError(Exception):
+    pass
+
+
+def ensure_consumer_group(redis_server):
+    """Creates the gear check stream and its consumer group if they don't exist yet"""
+    try:
+        redis_server.xgroup_create(GEAR_CHECK_STREAM, GEAR_CHECK_CONSUMER_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+class GearCheckJobWorker(object):
+    """
+    Consumes gear check jobs from the gear check stream as part of the consumer group,
+    running up to `concurrency` jobs at once.
+
+    A job is only acknowledged once process_job finishes without raising. Jobs
+    that are left unacknowledged for too long, whether this worker failed them
+    or another worker died while running them, are claimed and run again, up to
+    MAX_JOB_DELIVERIES times.
+
+    Each running worker needs its own consumer name, since a worker starts by
+    rerunning every job that was delivered to its name and never acknowledged.
+    run raises ConsumerNameInUseError if another worker is using the name.
+    """
+    def __init__(self,
+                 redis_server,
+                 consumer_name: str,
+                 process_job,
+                 concurrency: int = DEFAULT_WORKER_CONCURRENCY):
+        self.redis_server = redis_server
+        self.consumer_name = consumer_name
+        self.process_job = process_job
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._lease_key = CONSUMER_LEASE_KEY_PREFIX + consumer_name
+        self._lease_token = str(uuid.uuid4())
+        self._renew_lease_script = redis_server.register_script(RENEW_LEASE_SCRIPT)
+
+    async def run(self):
+        ensure_consumer_group(self.redis_server)
+        if not self.redis_server.set(
+            self._lease_key, self._lease_token, nx=True, ex=CONSUMER_LEASE_SECONDS
+        ):
+            raise ConsumerNameInUseError(
+                f'Another gear check worker is running as {self.consumer_name}, ' + \
+                'give each worker its own name'
+            )
+        lease_task = asyncio.ensure_future(self._renew_lease())
+        try:
+            await self._consume()
+        finally:
+            lease_task.cancel()
+            if self.redis_server.get(self._lease_key) == self._lease_token.encode('utf-8'):
+                self.redis_server.delete(self._lease_key)
+
+    async def _consume(self):
+        # start with anything this consumer was given before it last restarted
+        await self._run_entries(await self._call_redis(
+            self.redis_server.xreadgroup,
+            GEAR_CHECK_CONSUMER_GROUP, self.consumer_name, {GEAR_CHECK_STREAM: '0'}
+        ))
+        while True:
+            await self._run_entries(await self._claim_stuck_entries())
+            await self._run_entries(await self._call_redis(
+                self.redis_server.xreadgroup,
+                GEAR_CHECK_CONSUMER_GROUP, self.consumer_name, {GEAR_CHECK_STREAM: '>'},
+                count=self.concurrency, block=READ_BLOCK_MILLISECONDS
+            ))
+
+    async def _renew_lease(self):
+        while True:
+            await asyncio.sleep(CONSUMER_LEASE_SECONDS / 3)
+            try:
+                renewed = await self._call_redis(
+                    self._renew_lease_script,
+                    keys=[self._lease_key],
+                    args=[self._lease_token, CONSUMER_LEASE_SECONDS]
+                )
+                if not renewed:
+                    logging.error(f'Gear check worker {self.consumer_name} lost its consumer name')
+            except Exception as e:
+                logging.error(e)
+
+    async def _call_redis(self, method, *args, **kwargs):
+        # the redis client blocks, so keep it off the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+    async def _claim_stuck_entries(self):
+        pending = await self._call_redis(
+            self.redis_server.xpending_range,
+            GEAR_CHECK_STREAM, GEAR_CHECK_CONSUMER_GROUP, '-', '+', CLAIM_BATCH_SIZE
+        )
+        stuck_ids = []
+        for entry in pending:
+            if entry['time_since_delivered'] < CLAIM_IDLE_MILLISECONDS:
+                continue
+            if entry['times_delivered'] >= MAX_JOB_DELIVERIES:
+                await self._dead_letter(entry['message_id'])
+            else:
+                stuck_ids.append(entry['message_id'])
+        if len(stuck_ids) == 0:
+            return []
+        claimed = await self._call_redis(
+            self.redis_server.xclaim,
+            GEAR_CHECK_STREAM, GEAR_CHECK_CONSUMER_GROUP, self.consumer_name,
+            CLAIM_IDLE_MILLISECONDS, stuck_ids
+        )
+        return [[GEAR_CHECK_STREAM, claimed]]
+
+    async def _dead_letter(self, entry_id):
+        entries = await self._call_redis(self.redis_server.xrange, GEAR_CHECK_STREAM, entry_id, entry_id)
+        if len(entries) > 0:
+            await self._call_redis(self.redis_server.xadd, GEAR_CHECK_DEAD_LETTER_STREAM, entries[0][1])
+        await self._call_redis(self.redis_server.xack, GEAR_CHECK_STREAM, GEAR_CHECK_CONSUMER_GROUP, entry_id)
+        logging.error(f'Gave up on gear check job {entry_id} after {MAX_JOB_DELIVERIES} attempts')
+
+    async def _run_entries(self, streams):
+        for _, entries in streams or []:
+            for entry_id, fields in entries:
+                # waits here until one of our running jobs finishes
+                await self._semaphore.acquire()
+                task = asyncio.ensure_future(self._run_entry(entry_id, fields))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run_entry(self, entry_id, fields):
+        try:
+            job = convert_json_to_object(fields[b'job'].decode('utf-8'), GearCheckJob)
+            await self.process_job(job)
+            await self._call_redis(self.redis_server.xack, GEAR_CHECK_STREAM, GEAR_CHECK_CONSUMER_GROUP, entry_id)
+        except Exception as e:
+            # left unacknowledged, so it is retried once it has been idle for long enough
+            logging.error(e)
+        finally:
+            self._semaphore.release()
@@ -5,31 +5,65 @@ from utils import (
 )
 
 MENTION_ALL_ROLES_ID = -1
+DEFAULT_REGION = 'US'
+# the regions warcraft logs has servers in
+SUPPORTED_REGIONS = ['US', 'EU', 'KR', 'TW', 'CN']
+# other names people use for a region
+REGION_ALIASES = {
+    'NA': 'US',
+}
 
 def convert_json_list_to_objects(json_list, cls: JSONSerializable.__class__):
     if len(json_list) == 0:
         return list()
     return [cls.from_json_dict(**json_dict) for json_dict in json_list]
 
+class RealmInfo(JSONSerializable):
+    """A realm, and the region it is in, that characters may be looked up on"""
+    def __init__(self, realm: str, region: str = DEFAULT_REGION):
+        self.realm = realm
+        self.region = region
+
+    def __eq__(self, other):
+        return isinstance(other, RealmInfo) and \
+            self.realm.lower() == other.realm.lower() and \
+            self.region.upper() == other.region.upper()
+
+    def __hash__(self):
+        return hash((self.realm.lower(), self.region.upper()))
+
+    @staticmethod
+    def from_json_dict(**kwargs):
+        return RealmInfo(**kwargs)
+
+
 class GearCheckConfigurationInfo(JSONSerializable):
     """ 
     Contains properties necessary to define which guild has
     gear check messages being posted to it, and which guild/channel should
     be having these messages forwarded (with additional character info)
+
+    realms is the ordered list of RealmInfos that characters are looked up on.
+    realm is the first of them, and is all that older configurations have.
     """ 
     def __init__(self, 
                  source_guild_id: int, 
                  destination_guild_id: int, 
                  destination_channel_id: int, 
-                 realm: str):
+                 realm: str,
+                 realms: list = None):
         self.source_guild_id = source_guild_id
         self.destination_guild_id = destination_guild_id
         self.destination_channel_id = destination_channel_id
         self.realm = realm
+        self.realms = realms or [RealmInfo(realm)]
 
     @staticmethod 
-    def from_json_dict(**kwargs):
-        return GearCheckConfigurationInfo(**kwargs)    
+    def from_json_dict(realms=None, **kwargs):
+        return GearCheckConfigurationInfo(
+            realms=convert_json_list_to_objects(realms or [], RealmInfo),
+            **kwargs
+        )
 
 
 class BuffAlertConfigurationInfo(JSONSerializable):
@@ -52,6 +86,46 @@ class BuffAlertConfigurationInfo(JSONSerializable):
         return BuffAlertConfigurationInfo(**kwargs)      
 
 
+class GearCheckJob(JSONSerializable):
+    """
+    Contains everything needed to finish a gear check once its message has been
+    classified, so the work can be handed off to a worker process.
+
+    sent_message_ids holds the ids of messages already forwarded to each of the
+    destinations (in progressive mode), which are edited rather than sent again.
+    """
+    def __init__(self,
+                 message_id: int,
+                 channel_id: int,
+                 guild_id: int,
+                 channel_name: str,
+                 author_display_name: str,
+                 author_mention: str,
+                 jump_url: str,
+                 zone_id: int,
+                 gear_url: str,
+                 destination_infos: list,
+                 sent_message_ids: list = None):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.channel_name = channel_name
+        self.author_display_name = author_display_name
+        self.author_mention = author_mention
+        self.jump_url = jump_url
+        self.zone_id = zone_id
+        self.gear_url = gear_url
+        self.destination_infos = destination_infos
+        self.sent_message_ids = sent_message_ids or list()
+
+    @staticmethod
+    def from_json_dict(destination_infos, **kwargs):
+        return GearCheckJob(
+            destination_infos=convert_json_list_to_objects(destination_infos, GearCheckConfigurationInfo),
+            **kwargs
+        )
+
+
 class DirectionalGuildConfiguration(object):
     """
     This class contains information about a guild (server) and its relationship
@@ -97,13 +171,13 @@ class DestinationGuildConfiguration(DirectionalGuildConfiguration):
     def add_gear_check_source(self, 
                               source_guild_id: int, 
                               destination_channel_id: int, 
-                              realm: str):
+                              realms: list):
         if len(list(filter(lambda info: info.source_guild_id == source_guild_id, 
                            self.gear_check_infos))) > 0:
             return False
         self.gear_check_infos.append(
             GearCheckConfigurationInfo(
-                source_guild_id, self.guild_id, destination_channel_id, realm
+                source_guild_id, self.guild_id, destination_channel_id, realms[0].realm, realms
             )
         )
         return True
@@ -142,10 +216,10 @@ class SourceGuildConfiguration(DirectionalGuildConfiguration):
     def add_gear_check_destination(self, 
                                    destination_guild_id: int, 
                                    destination_channel_id: int, 
-                                   realm: str):
+                                   realms: list):
         self.gear_check_infos.append(
             GearCheckConfigurationInfo(
-                self.guild_id, destination_guild_id, destination_channel_id, realm
+                self.guild_id, destination_guild_id, destination_channel_id, realms[0].realm, realms
             )
         )        
 
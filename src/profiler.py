@@ -0,0 +1,194 @@
+"""Module for profiling the running bot without restarting it"""
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.005
+NUM_TOP_ENTRIES = 25
+TRACEMALLOC_NUM_FRAMES = 10
+
+# maps an area of the bot to a function that returns whether a frame belongs to it,
+# so the report can say how much time went to each of them
+PROFILED_AREAS = {
+    'on_message handlers': lambda code: code.co_name == 'on_message',
+    'gear page rendering': lambda code: code.co_name in ('get_character_name', 'arender'),
+    'redis calls': lambda code: f'{os.sep}redis{os.sep}' in code.co_filename,
+}
+
+
+class ProfileAlreadyRunningError(Exception):
+    pass
+
+
+class StackSampler(object):
+    """
+    A sampling cpu profiler.
+
+    A daemon thread periodically takes the stack of the given thread (the event
+    loop's), so the profiled code keeps running untouched while we record where
+    it spends its time. Other threads, like discord's heartbeat and the idle
+    executor threads, are left out so they don't dilute the samples.
+    """
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.num_samples = 0
+        self.self_counts = collections.Counter()
+        self.cumulative_counts = collections.Counter()
+        self.area_counts = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='tog-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._record(frame)
+
+    def _record(self, frame):
+        self.num_samples += 1
+        self.self_counts[get_frame_label(frame.f_code, frame.f_lineno)] += 1
+        seen_functions = set()
+        seen_areas = set()
+        while frame is not None:
+            code = frame.f_code
+            seen_functions.add(get_frame_label(code, code.co_firstlineno))
+            for area, is_in_area in PROFILED_AREAS.items():
+                if is_in_area(code):
+                    seen_areas.add(area)
+            frame = frame.f_back
+        # recursive functions only count once per sample
+        self.cumulative_counts.update(seen_functions)
+        self.area_counts.update(seen_areas)
+
+
+def get_frame_label(code, line_number):
+    return f'{code.co_filename}:{line_number}({code.co_name})'
+
+
+class BotProfiler(object):
+    """
+    Runs a cpu profile and tracemalloc snapshots over a window of time,
+    and renders the results as a text report.
+
+    Only one profile can run at once.
+    """
+    def __init__(self, sample_interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS):
+        self.sample_interval = sample_interval
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_running(self):
+        return self._lock.locked()
+
+    async def profile(self, seconds: float):
+        """Profiles the bot for the given number of seconds, returning the report"""
+        if self.is_running:
+            raise ProfileAlreadyRunningError('A profile is already running.')
+        async with self._lock:
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start(TRACEMALLOC_NUM_FRAMES)
+            # profile() runs on the event loop, which is where our handlers run
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            # snapshots and the report take seconds when a lot of memory is traced,
+            # so keep them off the event loop, which is still serving traffic
+            loop = asyncio.get_event_loop()
+            try:
+                start_snapshot = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+                start_time = time.monotonic()
+                sampler.start()
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+                end_snapshot = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            elapsed = time.monotonic() - start_time
+            return await loop.run_in_executor(
+                None, build_report, sampler, start_snapshot, end_snapshot, elapsed
+            )
+
+
+def build_report(sampler, start_snapshot, end_snapshot, elapsed):
+    """Renders the results of a profile as text"""
+    lines = [
+        f'Profiled for {elapsed:.1f}s, {sampler.num_samples} stack samples ' + \
+        f'every {sampler.interval * 1000:.0f}ms.',
+        '',
+        'Samples by area:',
+    ]
+    for area in PROFILED_AREAS:
+        lines.append(f'  {format_sample_share(sampler.area_counts[area], sampler.num_samples)} {area}')
+
+    lines += ['', f'Top {NUM_TOP_ENTRIES} functions by self samples:']
+    for label, count in sampler.self_counts.most_common(NUM_TOP_ENTRIES):
+        lines.append(f'  {format_sample_share(count, sampler.num_samples)} {label}')
+
+    lines += ['', f'Top {NUM_TOP_ENTRIES} functions by cumulative samples:']
+    for label, count in sampler.cumulative_counts.most_common(NUM_TOP_ENTRIES):
+        lines.append(f'  {format_sample_share(count, sampler.num_samples)} {label}')
+
+    lines += ['', f'Top {NUM_TOP_ENTRIES} allocation sites by growth:']
+    snapshot_filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]
+    stats = end_snapshot.filter_traces(snapshot_filters).compare_to(
+        start_snapshot.filter_traces(snapshot_filters), 'lineno'
+    )
+    for stat in stats[:NUM_TOP_ENTRIES]:
+        lines.append(f'  {stat}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_sample_share(count, num_samples):
+    percent = 100 * count / num_samples if num_samples > 0 else 0
+    return f'{percent:5.1f}% {count:6d}'
+
+
+def install_profile_signal_handler(loop,
+                                   profiler,
+                                   seconds: float,
+                                   output_dir: str,
+                                   signal_number=getattr(signal, 'SIGUSR1', None)):
+    """
+    Profiles the bot for the given number of seconds whenever it receives the given
+    signal (eg `kill -USR1 <pid>`), writing the report to a file in output_dir.
+    """
+    async def write_profile_report():
+        try:
+            report = await profiler.profile(seconds)
+        except ProfileAlreadyRunningError as e:
+            logging.error(e)
+            return
+        report_path = os.path.join(output_dir, f'tog-profile-{int(time.time())}.txt')
+        with open(report_path, 'w') as report_file:
+            report_file.write(report)
+        logging.warning(f'Wrote profile report to {report_path}')
+
+    if signal_number is None:
+        logging.warning('Profiling on a signal is not supported on this platform')
+        return
+    try:
+        loop.add_signal_handler(
+            signal_number, lambda: asyncio.ensure_future(write_profile_report(), loop=loop)
+        )
+    except NotImplementedError:
+        # signal handlers aren't supported on every platform (eg windows)
+        logging.warning('Profiling on a signal is not supported on this platform')
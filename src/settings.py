@@ -0,0 +1,74 @@
+"""Module for reading the bot's settings, which are stored in redis"""
+import appdirs
+
+from http_cache import (
+    DEFAULT_MAX_CACHE_BYTES,
+    open_http_cache,
+)
+from wcl_quota import (
+    DEFAULT_BURST,
+    DEFAULT_REQUESTS_PER_HOUR,
+    WarcraftLogsQuota,
+)
+from warcraft_logs import (
+    WarcraftLogsGraphQLClient,
+    WCL_BASE_URL,
+)
+
+
+def get_setting(redis_server, key):
+    return str(redis_server.get(key).decode('utf-8'))
+
+
+def get_optional_setting(redis_server, key, default=None):
+    value = redis_server.get(key)
+    return default if value is None else str(value.decode('utf-8'))
+
+
+def get_flag_setting(redis_server, key):
+    return get_optional_setting(redis_server, key, 'false').lower() == 'true'
+
+
+def create_http_cache(redis_server):
+    """
+    Gear pages and warcraft logs responses are kept on disk across restarts,
+    so they can be revalidated rather than downloaded (and rendered) again
+    """
+    return open_http_cache(
+        get_optional_setting(redis_server, 'HTTP_CACHE_DIR', appdirs.user_cache_dir('TOGHelper')),
+        int(get_optional_setting(redis_server, 'HTTP_CACHE_MAX_BYTES', DEFAULT_MAX_CACHE_BYTES))
+    )
+
+
+def create_wcl_client(redis_server, wcl_quota=None):
+    """
+    When v2 api credentials are configured, warcraft logs lookups are batched
+    through the GraphQL api rather than made one at a time against the v1 api.
+    WCL_BASE_URL can point at a local stub server for testing.
+
+    Returns None if the v2 api is not configured.
+    """
+    client_id = get_optional_setting(redis_server, 'WCL_CLIENT_ID')
+    client_secret = get_optional_setting(redis_server, 'WCL_CLIENT_SECRET')
+    if not client_id or not client_secret:
+        return None
+    return WarcraftLogsGraphQLClient(
+        client_id,
+        client_secret,
+        base_url=get_optional_setting(redis_server, 'WCL_BASE_URL', WCL_BASE_URL),
+        quota=wcl_quota
+    )
+
+
+def create_wcl_quota(redis_server):
+    """
+    Every process shares one budget for warcraft logs requests, which should be
+    set to the rate limit of the api key being used
+    """
+    return WarcraftLogsQuota(
+        redis_server,
+        requests_per_hour=int(get_optional_setting(
+            redis_server, 'WCL_QUOTA_PER_HOUR', DEFAULT_REQUESTS_PER_HOUR
+        )),
+        burst=int(get_optional_setting(redis_server, 'WCL_QUOTA_BURST', DEFAULT_BURST))
+    )
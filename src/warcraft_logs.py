@@ -0,0 +1,252 @@
+"""Module for looking up characters through the warcraft logs v2 (GraphQL) api"""
+import aiohttp
+import asyncio
+import json
+import logging
+import time
+
+from urllib.parse import quote
+from wcl_quota import (
+    PRIORITY_INTERACTIVE,
+    QuotaExhaustedError,
+)
+
+WCL_BASE_URL = 'https://classic.warcraftlogs.com'
+WCL_TOKEN_PATH = '/oauth/token'
+WCL_GRAPHQL_PATH = '/api/v2/client'
+
+# How long we wait for other lookups to arrive before sending a batch upstream.
+# A burst of applicants (or one applicant forwarded to several destinations)
+# lands in this window and costs a single request.
+DEFAULT_BATCH_WINDOW_SECONDS = 0.005
+# Upper bound on the number of characters in one query, so a huge burst
+# doesn't build a query that warcraft logs rejects for complexity
+DEFAULT_MAX_BATCH_SIZE = 50
+# Refresh the oauth token this long before warcraft logs says it expires
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+
+def get_server_slug(realm):
+    """Converts a realm name like "Zandalar Tribe" to the slug warcraft logs uses"""
+    return realm.strip().lower().replace("'", '').replace(' ', '-')
+
+
+def build_warcraft_logs_url(zone_id, character_name, realm, region='US'):
+    """Returns the warcraft logs character page for the given character and zone"""
+    return f'https://classic.warcraftlogs.com/character/{region.lower()}/' + \
+           f'{quote(get_server_slug(realm))}/{quote(character_name)}?zone={zone_id}'
+
+
+class CharacterLookup(object):
+    """A single pending request for a character's rankings in a zone"""
+    def __init__(self,
+                 zone_id: int,
+                 character_name: str,
+                 realm: str,
+                 region: str,
+                 priority: int,
+                 future):
+        self.zone_id = zone_id
+        self.character_name = character_name
+        self.realm = realm
+        self.region = region
+        self.priority = priority
+        self.future = future
+
+    @property
+    def character_key(self):
+        return (self.character_name.lower(), get_server_slug(self.realm), self.region.upper())
+
+
+class WarcraftLogsGraphQLClient(object):
+    """
+    Looks up characters through the warcraft logs v2 api.
+
+    Lookups made within a few milliseconds of each other are collected by a
+    micro-batcher and sent as one aliased GraphQL query, with one alias per
+    character and one nested alias per zone.
+
+    If a WarcraftLogsQuota is given, each batch takes one request from its budget,
+    at the priority of the most important lookup in the batch.
+    """
+    def __init__(self,
+                 client_id: str,
+                 client_secret: str,
+                 base_url: str = WCL_BASE_URL,
+                 batch_window: float = DEFAULT_BATCH_WINDOW_SECONDS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 quota=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.quota = quota
+        self.base_url = base_url.rstrip('/')
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        # holds a reference to batches being sent, so they aren't garbage collected
+        # before they resolve their lookups
+        self._batch_tasks = set()
+        self._flush_handle = None
+        self._session = None
+        self._access_token = None
+        self._access_token_expiry = 0
+
+    async def get_zone_rankings(self,
+                                zone_id,
+                                character_name,
+                                realm,
+                                region='US',
+                                priority=PRIORITY_INTERACTIVE):
+        """
+        Returns the character's zoneRankings json for the given zone, or None
+        if the character could not be found.
+
+        Raises QuotaExhaustedError if there was no budget left to look it up.
+        """
+        loop = asyncio.get_event_loop()
+        lookup = CharacterLookup(
+            zone_id, character_name, realm, region, priority, loop.create_future()
+        )
+        self._pending.append(lookup)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await lookup.future
+
+    async def close(self):
+        # let batches that are already on their way finish with the session
+        if len(self._batch_tasks) > 0:
+            await asyncio.wait(self._batch_tasks)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if len(batch) > 0:
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, batch):
+        characters = {}
+        for lookup in batch:
+            characters.setdefault(lookup.character_key, []).append(lookup)
+
+        try:
+            priority = min(lookup.priority for lookup in batch)
+            if self.quota is not None and not await self.quota.acquire(priority):
+                for lookup in batch:
+                    if not lookup.future.done():
+                        lookup.future.set_exception(QuotaExhaustedError())
+                return
+            query, aliases = build_batch_query(characters)
+            data = await self._execute(query)
+            character_data = (data or {}).get('characterData') or {}
+            for character_alias, lookups in aliases.items():
+                character = character_data.get(character_alias)
+                for lookup in lookups:
+                    if lookup.future.done():
+                        continue
+                    rankings = None
+                    if character is not None:
+                        rankings = character.get(f'z{lookup.zone_id}') or {}
+                    lookup.future.set_result(rankings)
+        except Exception as e:
+            logging.error(e)
+        finally:
+            # nothing else will resolve these, so a failed batch must not leave
+            # gear checks waiting on it forever
+            for lookup in batch:
+                if not lookup.future.done():
+                    lookup.future.set_result(None)
+
+    async def _execute(self, query):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+
+        for attempt in range(2):
+            headers = {'Authorization': f'Bearer {await self._get_access_token()}'}
+            async with self._session.post(
+                self.base_url + WCL_GRAPHQL_PATH,
+                json={'query': query},
+                headers=headers
+            ) as res:
+                if res.status == 401 and attempt == 0:
+                    # our token was revoked early, get a new one and try once more
+                    self._access_token = None
+                    continue
+                res.raise_for_status()
+                body = await res.json()
+
+            # errors for a single alias (eg an unknown realm) still return data
+            # for the other aliases, so only log them
+            for error in body.get('errors') or []:
+                logging.error(error.get('message'))
+            return body.get('data')
+
+    async def _get_access_token(self):
+        if self._access_token is not None and time.monotonic() < self._access_token_expiry:
+            return self._access_token
+
+        async with self._session.post(
+            self.base_url + WCL_TOKEN_PATH,
+            data={'grant_type': 'client_credentials'},
+            auth=aiohttp.BasicAuth(self.client_id, self.client_secret)
+        ) as res:
+            res.raise_for_status()
+            body = await res.json()
+        self._access_token = body['access_token']
+        self._access_token_expiry = time.monotonic() + \
+            body.get('expires_in', 0) - TOKEN_EXPIRY_MARGIN_SECONDS
+        return self._access_token
+
+
+def build_batch_query(characters):
+    """
+    Builds a single GraphQL query for every character in the given dict of
+    character key -> lookups.
+
+    Returns the query, as well as a dict of character alias -> lookups.
+    """
+    aliases = {}
+    character_queries = []
+    for i, ((_, server_slug, region), lookups) in enumerate(characters.items()):
+        alias = f'c{i}'
+        aliases[alias] = lookups
+        zone_ids = sorted(set(lookup.zone_id for lookup in lookups))
+        zone_queries = ' '.join(
+            f'z{zone_id}: zoneRankings(zoneID: {int(zone_id)})' for zone_id in zone_ids
+        )
+        # json string literals are valid GraphQL string literals, and escape
+        # anything odd that a user may have put in their character name
+        character_queries.append(
+            f'{alias}: character(name: {json.dumps(lookups[0].character_name)}, ' + \
+            f'serverSlug: {json.dumps(server_slug)}, ' + \
+            f'serverRegion: {json.dumps(region)}) {{ {zone_queries} }}'
+        )
+    return 'query { characterData { ' + ' '.join(character_queries) + ' } }', aliases
+
+
+def format_parse_summary(average_percentile, num_encounters):
+    """Returns a short, human readable summary of a character's parses"""
+    boss_noun = 'boss' if num_encounters == 1 else 'bosses'
+    return f'Average best parse: {average_percentile:.0f} across {num_encounters} {boss_noun}.'
+
+
+def summarize_zone_rankings(zone_rankings):
+    """Returns a short summary of the given zoneRankings json, or None if nothing was logged"""
+    killed_rankings = [
+        ranking for ranking in zone_rankings.get('rankings') or []
+        if ranking.get('totalKills') and ranking.get('rankPercent') is not None
+    ]
+    if len(killed_rankings) == 0:
+        return None
+    average = zone_rankings.get('bestPerformanceAverage')
+    if average is None:
+        average = sum(ranking['rankPercent'] for ranking in killed_rankings) / len(killed_rankings)
+    return format_parse_summary(average, len(killed_rankings))
@@ -0,0 +1,164 @@
+"""Module for budgeting requests to the warcraft logs api across every bot and worker process"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+
+# lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+
+# how long a request waits for budget before we give up on it. Interactive
+# requests have someone waiting on them, so they fall back quickly instead.
+DEFAULT_MAX_WAIT_SECONDS = {
+    PRIORITY_INTERACTIVE: 2,
+    PRIORITY_PREFETCH: 60,
+}
+# past this many waiting requests, new ones are shed right away
+MAX_QUEUE_DEPTH = 100
+# the longest we sleep before asking redis for budget again
+MAX_POLL_SECONDS = 1
+
+DEFAULT_REQUESTS_PER_HOUR = 3600
+DEFAULT_BURST = 100
+QUOTA_KEY = 'wcl_quota'
+
+# Refills the bucket for the time since it was last used, then takes `cost` tokens
+# from it if there are enough (a negative cost gives tokens back). Returns whether
+# the tokens were taken, the tokens left, and how long until there would be enough.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_per_ms)
+local allowed = 0
+local wait_ms = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+else
+    wait_ms = math.ceil((cost - tokens) / refill_per_ms)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_per_ms) + 1000)
+return {allowed, tostring(tokens), wait_ms}
+"""
+
+
+class QuotaExhaustedError(Exception):
+    """Raised for a warcraft logs request that was dropped because the budget ran out"""
+    pass
+
+
+class WarcraftLogsQuota(object):
+    """
+    A token bucket for the warcraft logs api, kept in redis so that every process
+    using the same api key shares it.
+
+    Requests that can't be served right away wait in a local priority queue, so
+    interactive gear checks are always served before background work. When the
+    budget runs out, acquire returns False rather than blocking indefinitely, and
+    callers should fall back to not calling the api.
+    """
+    def __init__(self,
+                 redis_server,
+                 requests_per_hour: int = DEFAULT_REQUESTS_PER_HOUR,
+                 burst: int = DEFAULT_BURST,
+                 key: str = QUOTA_KEY):
+        self.requests_per_hour = requests_per_hour
+        self.burst = burst
+        self.key = key
+        self._script = redis_server.register_script(TOKEN_BUCKET_SCRIPT)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._refunds = set()
+
+    @property
+    def queue_depth(self):
+        return len([entry for entry in self._queue if not entry[-1].done()])
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, cost: int = 1, max_wait: float = None):
+        """
+        Waits up to max_wait seconds to take `cost` requests from the budget.
+
+        Returns whether the requests may be made.
+        """
+        if self.queue_depth >= MAX_QUEUE_DEPTH:
+            return False
+        if max_wait is None:
+            max_wait = DEFAULT_MAX_WAIT_SECONDS.get(priority, DEFAULT_MAX_WAIT_SECONDS[PRIORITY_PREFETCH])
+
+        cost = min(cost, self.burst)
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), cost, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return future.result()
+            future.cancel()
+            return False
+        except asyncio.CancelledError:
+            # the dispatcher drops cancelled entries, and gives back tokens it
+            # took for this one while we were being cancelled
+            if not future.cancel() and future.result():
+                # the tokens were granted just before we were cancelled
+                refund = asyncio.ensure_future(self._refund(cost))
+                self._refunds.add(refund)
+                refund.add_done_callback(self._refunds.discard)
+            raise
+
+    async def get_remaining_budget(self):
+        """Returns how many requests could be made right now"""
+        _, tokens, _ = await self._take(0)
+        return tokens
+
+    async def _dispatch(self):
+        while len(self._queue) > 0:
+            entry = self._queue[0]
+            _, _, cost, future = entry
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            try:
+                allowed, _, wait_ms = await self._take(cost)
+            except Exception as e:
+                # without redis we can't know the budget, so don't spend it
+                logging.error(e)
+                allowed, wait_ms = None, 0
+            if allowed is None or allowed:
+                # a more important request may have been queued while we waited on
+                # redis, so this entry isn't necessarily at the front anymore
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                if not future.done():
+                    future.set_result(bool(allowed))
+                elif allowed:
+                    # the request gave up waiting while we were taking its tokens
+                    await self._refund(cost)
+            else:
+                await asyncio.sleep(min(wait_ms / 1000, MAX_POLL_SECONDS))
+
+    async def _refund(self, cost):
+        try:
+            await self._take(-cost)
+        except Exception as e:
+            logging.error(e)
+
+    async def _take(self, cost):
+        loop = asyncio.get_event_loop()
+        allowed, tokens, wait_ms = await loop.run_in_executor(None, functools.partial(
+            self._script,
+            keys=[self.key],
+            args=[self.burst, self.requests_per_hour / (3600 * 1000), cost]
+        ))
+        return allowed == 1, float(tokens), wait_ms
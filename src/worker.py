@@ -0,0 +1,75 @@
+"""
+Module containing the entrypoint to a gear check worker.
+
+Workers finish the gear checks that the bot adds to the gear check redis stream
+when GEAR_CHECK_QUEUE is enabled: rendering gear pages, looking up warcraft logs
+and forwarding the results. Any number of them can run, on any host that can
+reach redis, and they only talk to discord over its http api.
+
+Every running worker needs its own consumer name, which has to stay the same
+across restarts so a restarted worker picks its unfinished jobs back up. It is
+TOG_WORKER_NAME if that is set, otherwise the host name followed by
+TOG_WORKER_INDEX (0 by default), so several workers on one host should each be
+given their own TOG_WORKER_INDEX, eg 0, 1, 2. A worker refuses to start while
+another is running under the same name.
+"""
+import asyncio
+import discord
+import logging
+import os
+import redis
+import socket
+
+from gear_check import process_gear_check_job
+from job_queue import (
+    DEFAULT_WORKER_CONCURRENCY,
+    GearCheckJobWorker,
+)
+from settings import (
+    create_http_cache,
+    create_wcl_client,
+    create_wcl_quota,
+    get_optional_setting,
+    get_setting,
+)
+
+
+async def main():
+    redis_server = redis.Redis()
+    auth_token = get_setting(redis_server, 'TOG_BOT_AUTH_TOKEN')
+    wcl_token = get_setting(redis_server, 'WCL_TOKEN')
+    http_cache = create_http_cache(redis_server)
+    wcl_quota = create_wcl_quota(redis_server)
+    wcl_client = create_wcl_client(redis_server, wcl_quota)
+
+    client = discord.Client()
+    # logs in over http only, the gateway connection stays with the bot
+    await client.login(auth_token)
+
+    async def process_job(job):
+        await process_gear_check_job(
+            job, client.http, wcl_token, wcl_client, http_cache, wcl_quota, redis_server
+        )
+
+    consumer_name = os.environ.get(
+        'TOG_WORKER_NAME', f'{socket.gethostname()}-{os.environ.get("TOG_WORKER_INDEX", "0")}'
+    )
+    worker = GearCheckJobWorker(
+        redis_server,
+        consumer_name,
+        process_job,
+        concurrency=int(get_optional_setting(
+            redis_server, 'GEAR_CHECK_WORKER_CONCURRENCY', DEFAULT_WORKER_CONCURRENCY
+        ))
+    )
+    try:
+        await worker.run()
+    finally:
+        if wcl_client is not None:
+            await wcl_client.close()
+        await client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,15 @@
+from commands.configuration import parse_realm_info
+from models import RealmInfo
+
+
+def test_parses_realms_with_regions():
+    assert parse_realm_info('Faerlina') == RealmInfo('Faerlina', 'US')
+    assert parse_realm_info('Zandalar Tribe: eu') == RealmInfo('Zandalar Tribe', 'EU')
+
+
+def test_maps_na_to_the_us_region():
+    assert parse_realm_info('Faerlina:NA') == RealmInfo('Faerlina', 'US')
+
+
+def test_rejects_unknown_regions():
+    assert parse_realm_info('Faerlina:XX') is None
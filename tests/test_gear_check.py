@@ -0,0 +1,208 @@
+import asyncio
+import gear_check
+import pytest
+import re
+
+from types import SimpleNamespace
+
+from gear_check import (
+    background_tasks,
+    cache_character_realm,
+    find_first_result,
+    get_cached_character_realm,
+    handle_gear_check_message,
+    lookup_warcraft_logs_for_destinations,
+)
+from models import (
+    GearCheckConfigurationInfo,
+    GuildConfiguration,
+    RealmInfo,
+)
+from utils import convert_to_json_str
+from test_warcraft_logs import StubWarcraftLogsClient
+
+fakeredis = pytest.importorskip('fakeredis')
+
+FAERLINA = RealmInfo('Faerlina')
+BENEDICTION = RealmInfo('Benediction')
+ZANDALAR_TRIBE = RealmInfo('Zandalar Tribe', 'EU')
+
+
+def create_destination_info(realms, source_guild_id=1):
+    return GearCheckConfigurationInfo(source_guild_id, 2, 3, realms[0].realm, realms)
+
+
+def test_find_first_result_returns_the_first_hit_and_cancels_the_rest():
+    cancelled = []
+
+    async def lookup(delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return f'found after {delay}' if delay > 0 else None
+
+    async def run():
+        result = await find_first_result([0, 0.05, 5], lookup)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == (0.05, 'found after 0.05')
+    assert cancelled == [5]
+
+
+def test_find_first_result_prefers_candidates_in_order():
+    async def lookup(candidate):
+        return candidate
+
+    assert asyncio.run(find_first_result(['first', 'second'], lookup)) == ('first', 'first')
+
+
+def test_find_first_result_returns_none_when_nothing_is_found():
+    async def lookup(candidate):
+        if candidate == 'broken':
+            raise ValueError('lookup failed')
+        return None
+
+    assert asyncio.run(find_first_result(['missing', 'broken'], lookup)) == (None, None)
+
+
+def found_on(server_slug):
+    """Answers queries by finding only the character on the given server"""
+    def respond(query):
+        return {'characterData': {
+            alias: {'z1000': {}} if slug == server_slug else None
+            for alias, slug in re.findall(r'(c\d+): character\(name: "[^"]*", serverSlug: "([^"]*)"', query)
+        }}
+    return respond
+
+
+def lookup_bob(client, redis_server, destination_info):
+    return asyncio.run(lookup_warcraft_logs_for_destinations(
+        1000, 'Bob', [destination_info], None, client, redis_server=redis_server
+    ))
+
+
+def test_remembers_the_realm_a_character_was_found_on():
+    redis_server = fakeredis.FakeRedis()
+    destination_info = create_destination_info([FAERLINA, BENEDICTION, ZANDALAR_TRIBE])
+    client = StubWarcraftLogsClient(found_on('zandalar-tribe'))
+
+    assert lookup_bob(client, redis_server, destination_info) == [
+        ('https://classic.warcraftlogs.com/character/eu/zandalar-tribe/Bob?zone=1000', None)
+    ]
+    # every candidate realm was looked up in one batch
+    assert len(client.queries) == 1
+    assert get_cached_character_realm(redis_server, destination_info, 'bob') == ZANDALAR_TRIBE
+    # other configurations' realms are remembered separately
+    assert get_cached_character_realm(
+        redis_server, create_destination_info([ZANDALAR_TRIBE], source_guild_id=4), 'bob'
+    ) is None
+
+
+def test_looks_up_the_cached_realm_alone_first():
+    redis_server = fakeredis.FakeRedis()
+    destination_info = create_destination_info([FAERLINA, BENEDICTION, ZANDALAR_TRIBE])
+    cache_character_realm(redis_server, destination_info, 'Bob', BENEDICTION)
+    client = StubWarcraftLogsClient(found_on('benediction'))
+
+    assert lookup_bob(client, redis_server, destination_info) == [
+        ('https://classic.warcraftlogs.com/character/us/benediction/Bob?zone=1000', None)
+    ]
+    assert len(client.queries) == 1
+    assert 'faerlina' not in client.queries[0]
+
+
+def test_falls_back_to_every_other_realm_when_the_cached_realm_misses():
+    redis_server = fakeredis.FakeRedis()
+    destination_info = create_destination_info([FAERLINA, BENEDICTION, ZANDALAR_TRIBE])
+    cache_character_realm(redis_server, destination_info, 'Bob', BENEDICTION)
+    client = StubWarcraftLogsClient(found_on('faerlina'))
+
+    assert lookup_bob(client, redis_server, destination_info) == [
+        ('https://classic.warcraftlogs.com/character/us/faerlina/Bob?zone=1000', None)
+    ]
+    assert len(client.queries) == 2
+    assert 'benediction' not in client.queries[1]
+    assert get_cached_character_realm(redis_server, destination_info, 'bob') == FAERLINA
+
+
+class StubHTTPClient(object):
+    """Records the messages sent and edited instead of calling discord"""
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+
+    async def send_message(self, channel_id, content, embed=None, message_reference=None):
+        self.sent.append((channel_id, content, embed))
+        return {'id': str(100 + len(self.sent))}
+
+    async def edit_message(self, channel_id, message_id, embed=None):
+        self.edited.append((channel_id, message_id, embed))
+
+
+class StubChannel(SimpleNamespace):
+    def __str__(self):
+        return self.name
+
+
+def create_gear_check_message(redis_server, destination_channel_id):
+    source_config = GuildConfiguration(1)
+    source_config.source_config.add_gear_check_destination(2, destination_channel_id, [FAERLINA])
+    redis_server.set(1, convert_to_json_str(source_config))
+    return SimpleNamespace(
+        id=30,
+        channel=StubChannel(id=20, name='mc-gear-check'),
+        guild=SimpleNamespace(id=1),
+        author=SimpleNamespace(id=40, display_name='Bob', mention='<@40>'),
+        content='https://sixtyupgrades.com/character/abc123/set/def456',
+        jump_url='https://discord.com/channels/1/20/30',
+    )
+
+
+def run_progressive_gear_check(monkeypatch, get_character_name):
+    redis_server = fakeredis.FakeRedis()
+    message = create_gear_check_message(redis_server, destination_channel_id=50)
+    bot = SimpleNamespace(http=StubHTTPClient())
+    monkeypatch.setattr(gear_check, 'get_character_name', get_character_name)
+
+    async def run():
+        await handle_gear_check_message(
+            message, bot, None, redis_server,
+            wcl_client=StubWarcraftLogsClient(found_on('faerlina')), progressive=True
+        )
+        # the rest of the gear check, and any clean up after it, runs in the background
+        while len(background_tasks) > 0:
+            await asyncio.wait(list(background_tasks))
+
+    asyncio.run(run())
+    return bot.http
+
+
+def get_embed_text(embed):
+    return embed['fields'][0]['value']
+
+
+def test_progressive_gear_check_is_sent_then_filled_in(monkeypatch):
+    async def get_character_name(gear_url, default_name, http_cache=None):
+        return 'Bob'
+
+    http = run_progressive_gear_check(monkeypatch, get_character_name)
+
+    assert len(http.sent) == 1
+    assert 'Looking up their raid logs...' in get_embed_text(http.sent[0][2])
+    assert [(channel_id, message_id) for channel_id, message_id, _ in http.edited] == [(50, 101)]
+    assert 'https://classic.warcraftlogs.com/character/us/faerlina/Bob?zone=1000' in \
+        get_embed_text(http.edited[0][2])
+
+
+def test_failed_progressive_gear_check_replaces_its_placeholder(monkeypatch):
+    async def get_character_name(gear_url, default_name, http_cache=None):
+        raise RuntimeError('the gear page could not be rendered')
+
+    http = run_progressive_gear_check(monkeypatch, get_character_name)
+
+    assert len(http.sent) == 1
+    assert len(http.edited) == 1
+    assert 'Raid logs could not be retrieved.' in get_embed_text(http.edited[0][2])
@@ -0,0 +1,52 @@
+from http_cache import HTTPCache
+
+
+def create_cache(tmp_path, max_bytes=1024):
+    return HTTPCache(str(tmp_path / 'http_cache.sqlite3'), max_bytes)
+
+
+def test_stores_responses_that_can_be_revalidated(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.store('https://a', b'body', {'ETag': '"1"', 'Last-Modified': 'yesterday'}, derived='Bob')
+    cache.store('https://b', b'body', {})
+
+    entry = cache.get('https://a')
+    assert entry.body == b'body'
+    assert entry.derived == 'Bob'
+    assert entry.get_conditional_headers() == {'If-None-Match': '"1"', 'If-Modified-Since': 'yesterday'}
+    assert cache.get('https://b') is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+
+
+def test_revalidation_is_counted_apart_from_hits(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.store('https://a', b'body', {'ETag': '"1"'})
+
+    cache.get('https://a')
+    cache.record_revalidation('https://a')
+    cache.get('https://a')
+
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['revalidations'], stats['misses']) == (2, 1, 1)
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = create_cache(tmp_path, max_bytes=10)
+    cache.store('https://a', b'12345', {'ETag': '"a"'})
+    cache.store('https://b', b'12345', {'ETag': '"b"'})
+    cache.record_revalidation('https://a')
+    cache.store('https://c', b'12345', {'ETag': '"c"'})
+
+    assert cache.get('https://a') is not None
+    assert cache.get('https://b') is None
+    assert cache.get('https://c') is not None
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_stats_are_shared_across_instances(tmp_path):
+    create_cache(tmp_path).store('https://a', b'body', {'ETag': '"1"'})
+    create_cache(tmp_path).get('https://a')
+
+    stats = create_cache(tmp_path).get_stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
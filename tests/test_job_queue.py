@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+
+from job_queue import (
+    ConsumerNameInUseError,
+    CONSUMER_LEASE_KEY_PREFIX,
+    GearCheckJobWorker,
+)
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+async def do_nothing(job):
+    pass
+
+
+def test_workers_cannot_share_a_consumer_name():
+    redis_server = fakeredis.FakeRedis()
+    first_worker = GearCheckJobWorker(redis_server, 'host-0', do_nothing)
+    second_worker = GearCheckJobWorker(redis_server, 'host-0', do_nothing)
+
+    async def run():
+        first_run = asyncio.ensure_future(first_worker.run())
+        await asyncio.sleep(0.05)
+        with pytest.raises(ConsumerNameInUseError):
+            await second_worker.run()
+        first_run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first_run
+
+    asyncio.run(run())
+    # the name is released once its worker stops
+    assert redis_server.get(CONSUMER_LEASE_KEY_PREFIX + 'host-0') is None
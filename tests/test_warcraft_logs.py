@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+
+from aiohttp import web
+
+from warcraft_logs import (
+    build_warcraft_logs_url,
+    WarcraftLogsGraphQLClient,
+)
+from wcl_quota import QuotaExhaustedError
+
+
+class StubWarcraftLogsClient(WarcraftLogsGraphQLClient):
+    """Answers queries with the given function instead of calling warcraft logs"""
+    def __init__(self, respond, quota=None):
+        super().__init__('client id', 'client secret', quota=quota)
+        self.respond = respond
+        self.queries = []
+
+    async def _execute(self, query):
+        self.queries.append(query)
+        return self.respond(query)
+
+
+class StubQuota(object):
+    """Hands out the given number of requests, recording the priority of each acquire"""
+    def __init__(self, remaining):
+        self.remaining = remaining
+        self.priorities = []
+
+    async def acquire(self, priority, cost=1, max_wait=None):
+        self.priorities.append(priority)
+        if self.remaining < cost:
+            return False
+        self.remaining -= cost
+        return True
+
+
+def run_lookups(client, lookups, timeout=2):
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*[
+            client.get_zone_rankings(*lookup) for lookup in lookups
+        ]), timeout)
+    return asyncio.run(run())
+
+
+def test_batches_lookups_into_one_aliased_query():
+    client = StubWarcraftLogsClient(lambda query: {
+        'characterData': {
+            'c0': {'z1000': {'bestPerformanceAverage': 90}, 'z1002': None},
+            'c1': None,
+        }
+    })
+    results = run_lookups(client, [
+        (1000, 'Bob', 'Faerlina'),
+        (1002, 'bob', 'Faerlina'),
+        (1000, 'Alice', 'Zandalar Tribe', 'EU'),
+    ])
+
+    assert len(client.queries) == 1
+    query = client.queries[0]
+    assert 'c0: character(name: "Bob", serverSlug: "faerlina", serverRegion: "US")' in query
+    assert 'z1000: zoneRankings(zoneID: 1000) z1002: zoneRankings(zoneID: 1002)' in query
+    assert 'c1: character(name: "Alice", serverSlug: "zandalar-tribe", serverRegion: "EU")' in query
+    assert results == [{'bestPerformanceAverage': 90}, {}, None]
+
+
+def test_failed_batch_resolves_every_lookup():
+    def respond(query):
+        raise ValueError('warcraft logs is down')
+    client = StubWarcraftLogsClient(respond)
+
+    assert run_lookups(client, [(1000, 'Bob', 'Faerlina'), (1000, 'Alice', 'Faerlina')]) == [None, None]
+
+
+def test_null_character_data_resolves_every_lookup():
+    client = StubWarcraftLogsClient(lambda query: {'characterData': None})
+
+    assert run_lookups(client, [(1000, 'Bob', 'Faerlina'), (1000, 'Alice', 'Faerlina')]) == [None, None]
+
+
+def test_batch_takes_one_request_from_the_quota():
+    quota = StubQuota(remaining=1)
+    client = StubWarcraftLogsClient(lambda query: {'characterData': {'c0': None, 'c1': None}}, quota)
+
+    run_lookups(client, [(1000, 'Bob', 'Faerlina', 'US', 1), (1000, 'Alice', 'Mankrik', 'US', 0)])
+
+    assert quota.remaining == 0
+    assert quota.priorities == [0]
+
+
+def test_exhausted_quota_fails_every_lookup_in_the_batch():
+    client = StubWarcraftLogsClient(lambda query: {'characterData': {}}, StubQuota(remaining=0))
+
+    with pytest.raises(QuotaExhaustedError):
+        run_lookups(client, [(1000, 'Bob', 'Faerlina'), (1000, 'Alice', 'Mankrik')])
+    assert client.queries == []
+
+
+def test_character_url_uses_the_realm_slug():
+    assert build_warcraft_logs_url(1000, 'Bob', "Zandalar Tribe", 'EU') == \
+        'https://classic.warcraftlogs.com/character/eu/zandalar-tribe/Bob?zone=1000'
+
+
+def test_refreshes_a_revoked_token_against_a_stub_server():
+    tokens_issued = []
+    queries = []
+
+    async def issue_token(request):
+        tokens_issued.append(f'token-{len(tokens_issued)}')
+        return web.json_response({'access_token': tokens_issued[-1], 'expires_in': 3600})
+
+    async def answer_query(request):
+        # the first token is revoked, as warcraft logs may do before it expires
+        if request.headers['Authorization'] != 'Bearer token-1':
+            return web.Response(status=401)
+        queries.append((await request.json())['query'])
+        return web.json_response({
+            'data': {'characterData': {'c0': {'z1000': {'bestPerformanceAverage': 75}}, 'c1': None}},
+            'errors': [{'message': 'Unknown server'}],
+        })
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/oauth/token', issue_token)
+        app.router.add_post('/api/v2/client', answer_query)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = WarcraftLogsGraphQLClient('client id', 'client secret', base_url=f'http://127.0.0.1:{port}')
+        try:
+            return await asyncio.gather(
+                client.get_zone_rankings(1000, 'Bob', 'Faerlina'),
+                client.get_zone_rankings(1000, 'Alice', 'Nowhere'),
+            )
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == [{'bestPerformanceAverage': 75}, None]
+    assert tokens_issued == ['token-0', 'token-1']
+    assert len(queries) == 1
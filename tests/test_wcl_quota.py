@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+
+from wcl_quota import WarcraftLogsQuota
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def create_quota(requests_per_hour, burst):
+    return WarcraftLogsQuota(fakeredis.FakeRedis(), requests_per_hour=requests_per_hour, burst=burst)
+
+
+def test_cancelled_waiter_is_not_charged():
+    # refills one request every 100ms
+    quota = create_quota(requests_per_hour=36000, burst=1)
+
+    async def run():
+        assert await quota.acquire()
+        waiter = asyncio.ensure_future(quota.acquire(max_wait=5))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert quota.queue_depth == 0
+        # long enough for the bucket to refill, but not for a second refill
+        # to cover a token taken by the cancelled waiter
+        await asyncio.sleep(0.15)
+        return await quota.get_remaining_budget()
+
+    assert asyncio.run(run()) > 0.9
+
+
+def test_refund_is_capped_at_the_burst():
+    quota = create_quota(requests_per_hour=1, burst=5)
+
+    async def run():
+        await quota._take(3)
+        after_take = await quota.get_remaining_budget()
+        await quota._refund(10)
+        return after_take, await quota.get_remaining_budget()
+
+    after_take, after_refund = asyncio.run(run())
+    assert after_take == pytest.approx(2, abs=0.01)
+    assert after_refund == 5
+
+
+def test_exhausted_budget_is_denied():
+    quota = create_quota(requests_per_hour=1, burst=1)
+
+    async def run():
+        return await quota.acquire(), await quota.acquire(max_wait=0.05)
+
+    assert asyncio.run(run()) == (True, False)